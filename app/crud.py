@@ -1,72 +1,242 @@
 import models, database
+import functools
+import re
+from collections import Counter, defaultdict
+from heapq import nlargest
+from operator import itemgetter
+from sqlalchemy import func, insert, text
 from sqlalchemy.orm import Session
 from typing import List, Dict
 
+__all__ = [
+    "create_command",
+    "create_commands",
+    "list_commands",
+    "search_commands",
+    "compute_stats",
+    "analyze_preferences",
+    "analyze_preferences_contextual",
+    "get_recent_context",
+]
+
+# Heuristic marker dictionaries used by analyze_preferences. Static, so they
+# are defined once at module scope instead of per call.
+LANG_MARKERS = {
+    "python": ("python", ".py", "pip", "pytest", "uv ", "conda", "poetry", "ruff", "mypy"),
+    "typescript": ("typescript", "ts ", ".ts", "tsc", "pnpm", "vite", "nextjs", "next.js"),
+    "javascript": ("javascript", "js ", ".js", "npm", "yarn", "node"),
+    "go": ("golang", " go ", ".go", "go build", "go test"),
+    "java": (" java ", ".java", "maven", "mvn ", "gradle"),
+    "rust": ("rust", ".rs", "cargo"),
+    "bash": ("bash", "zsh", ".sh", "shell"),
+}
+TASK_MARKERS = (
+    "refactor", "test", "optimize", "document", "deploy", "debug",
+    "fix", "lint", "typecheck", "benchmark", "profile", "migrate",
+)
+STYLE_MARKERS = ("async", "clean", "performance", "oop", "functional", "tdd", "cli", "script")
+FRAMEWORK_MARKERS = (
+    "fastapi", "flask", "django", "react", "nextjs", "vue", "svelte",
+    "spring", "springboot", "express", "nestjs",
+)
+TOOL_MARKERS = (
+    "docker", "kubernetes", "k8s", "git", "curl", "jq", "pytest", "pip", "conda", "poetry", "uv ",
+    "alembic", "black", "ruff", "flake8", "mypy", "pre-commit", "eslint", "prettier", "jest", "vitest",
+    "playwright", "cypress",
+)
+
+
+def _build_marker_index():
+    """Compile one fused regex over every heuristic marker.
+
+    Matching all markers then costs a single C-level pass per command text
+    instead of one substring scan per marker. A marker may feed several
+    counters (e.g. "pytest" counts as both a language signal and a tool),
+    so each word maps to a tuple of (counter_name, key) targets.
+
+    Markers that start/end with a word character get word-boundary guards,
+    which also fixes the old substring false positives (e.g. ".js" inside
+    "package.json", "rust" inside "trust").
+    """
+    targets: Dict[str, List] = defaultdict(list)
+    for lang, markers in LANG_MARKERS.items():
+        for m in markers:
+            targets[m.lower()].append(("languages", lang))
+    for name, markers in (
+        ("tasks", TASK_MARKERS),
+        ("styles", STYLE_MARKERS),
+        ("frameworks", FRAMEWORK_MARKERS),
+        ("tools", TOOL_MARKERS),
+    ):
+        for m in markers:
+            targets[m.lower()].append((name, m))
+
+    def guarded(word: str) -> str:
+        prefix = r"(?<!\w)" if word[0].isalnum() else ""
+        suffix = r"(?!\w)" if word[-1].isalnum() else ""
+        return prefix + re.escape(word) + suffix
+
+    # Longer alternatives first so e.g. "go build" wins over " go ".
+    words = sorted(targets, key=len, reverse=True)
+    pattern = re.compile("|".join(guarded(w) for w in words))
+    return {word: tuple(word_targets) for word, word_targets in targets.items()}, pattern
+
+
+_MARKER_TARGETS, _MARKER_RE = _build_marker_index()
+
+# Precomputed hour-range labels, e.g. 10 -> "10:00-11:00" (24 entries).
+_HOUR_RANGES = tuple(f"{h:02d}:00-{(h + 1) % 24:02d}:00" for h in range(24))
+
+# Monotonic data version, bumped on every write. The aggregate functions
+# below are pure functions of the stored commands, so caching them keyed on
+# this version makes repeat reads O(1) and invalidation automatic: a bumped
+# version simply misses the cache.
+_DATA_VERSION = 0
+
+
+def _bump_data_version():
+    global _DATA_VERSION
+    _DATA_VERSION += 1
+
+
 def create_command(command_text: str, tags: List[str]):
     """Insert a raw user command into the commands table (single-user mode)."""
-    with database.session_scope() as db:
-        entry = models.Command(
-            command_text=command_text,
-            tags=",".join(tags) if tags else "",
-        )
-        db.add(entry)
+    create_commands([{"command_text": command_text, "tags": tags}])
 
-def _serialize_commands(rows: List[models.Command]) -> List[Dict]:
-    """Convert ORM rows to plain serializable dicts without relying on lazy loads."""
-    serialized = []
-    for r in rows:
-        serialized.append({
-            "command_text": r.command_text,
-            "tags": r.tags.split(",") if r.tags else [],
-            "timestamp": r.timestamp.isoformat() + "Z",
-        })
-    return serialized
 
+def create_commands(items: List[Dict]) -> None:
+    """Insert a batch of commands in one transaction (single-user mode).
 
-def list_commands() -> List[Dict]:
-    """Return all commands ordered by newest first (single-user).
-
-    Note: We immediately serialize inside the session context so that no
-    attribute access is attempted after the session is closed, avoiding
-    detached instance refresh errors.
+    Each item is {"command_text": str, "tags": [str, ...]}. Uses core
+    executemany inserts instead of per-item ORM unit-of-work sessions, so a
+    burst of N commands costs one commit (one fsync) instead of N.
     """
+    if not items:
+        return
+    command_rows = [{"command_text": item["command_text"]} for item in items]
+    with database.session_scope() as db:
+        if not any(item.get("tags") for item in items):
+            # No tag child rows needed, so skip the RETURNING round trip.
+            db.execute(insert(models.Command), command_rows)
+        else:
+            ids = db.execute(
+                insert(models.Command).returning(
+                    models.Command.id, sort_by_parameter_order=True
+                ),
+                command_rows,
+            ).scalars().all()
+            tag_rows = [
+                {"command_id": command_id, "tag": t}
+                for command_id, item in zip(ids, items)
+                for t in (item.get("tags") or [])
+                if t
+            ]
+            if tag_rows:
+                db.execute(insert(models.CommandTag), tag_rows)
+    _bump_data_version()
+
+# ISO-8601 timestamp rendered by SQLite itself (millisecond precision), so
+# serialization never touches a Python datetime object per row.
+_TS_ISO = func.strftime("%Y-%m-%dT%H:%M:%fZ", models.Command.timestamp)
+
+
+def _tags_by_command(db: Session, ids: List[int] | None = None) -> Dict[int, List[str]]:
+    """Group command_tags rows by command id, optionally restricted to ids.
+
+    One column query replaces a per-command lazy load (same round-trip shape
+    as selectinload, without hydrating Command entities).
+    """
+    q = db.query(models.CommandTag.command_id, models.CommandTag.tag)
+    if ids is not None:
+        q = q.filter(models.CommandTag.command_id.in_(ids))
+    grouped: Dict[int, List[str]] = defaultdict(list)
+    for command_id, tag in q:
+        grouped[command_id].append(tag)
+    return grouped
+
+
+def list_commands() -> List[Dict]:
+    """Return all commands ordered by newest first (single-user)."""
     with database.session_scope() as db:
         rows = (
-            db.query(models.Command)
-            .order_by(models.Command.timestamp.desc())
+            db.query(models.Command.id, models.Command.command_text, _TS_ISO)
+            .order_by(models.Command.timestamp.desc(), models.Command.id.desc())
             .all()
         )
-        return _serialize_commands(rows)
+        tags_by_command = _tags_by_command(db)
+    return [
+        {
+            "command_text": command_text,
+            "tags": tags_by_command.get(command_id, []),
+            "timestamp": ts,
+        }
+        for command_id, command_text, ts in rows
+    ]
+
+def search_commands(query: str, limit: int = 10) -> List[Dict]:
+    """Full-text search over command text via the FTS5 index (newest first).
+
+    MATCH walks the inverted index, so cost scales with the number of
+    matching documents instead of a substring scan of every row.
+    """
+    if not query:
+        return []
+    with database.session_scope() as db:
+        rows = db.execute(text(
+            "SELECT c.id, c.command_text, "
+            "strftime('%Y-%m-%dT%H:%M:%fZ', c.timestamp) "
+            "FROM command_fts f JOIN commands c ON c.id = f.rowid "
+            "WHERE command_fts MATCH :q "
+            "ORDER BY c.timestamp DESC, c.id DESC LIMIT :limit"
+        ), {"q": query, "limit": limit}).fetchall()
+        ids = [r[0] for r in rows]
+        tags_by_command = _tags_by_command(db, ids) if ids else {}
+    return [
+        {
+            "command_text": command_text,
+            "tags": tags_by_command.get(command_id, []),
+            "timestamp": ts,
+        }
+        for command_id, command_text, ts in rows
+    ]
+
 
 def compute_stats() -> Dict:
-    """Compute basic statistics across commands (single-user)."""
+    """Compute basic statistics across commands (single-user).
+
+    Cached per data version; recomputed only after a write.
+    """
+    return _compute_stats_cached(_DATA_VERSION)
+
+
+@functools.lru_cache(maxsize=1)
+def _compute_stats_cached(version: int) -> Dict:
+    """Aggregation runs inside SQLite (GROUP BY) so only the bucketed counts
+    cross the DB boundary instead of one hydrated ORM row per command.
+    """
     with database.session_scope() as db:
-        rows = db.query(models.Command).all()
-        # Work with a fully serialized snapshot to avoid detached issues.
-        snap = list(rows)
-    total = len(snap)
-    tag_counter: Dict[str, int] = {}
-    hour_counter: Dict[int, int] = {}
-    for r in snap:
-        # tags
-        for t in (r.tags.split(",") if r.tags else []):
-            if not t:
-                continue
-            tag_counter[t] = tag_counter.get(t, 0) + 1
-        # active hours (UTC hour bucket)
-        hour = r.timestamp.hour
-        hour_counter[hour] = hour_counter.get(hour, 0) + 1
-
-    # top keywords derived from tags for MVP (could expand to NLP of command_text later)
-    top_keywords = sorted(tag_counter.items(), key=lambda x: x[1], reverse=True)[:5]
-    # Convert active hours into simple ranges (coarse heuristic)
-    active_hours_sorted = sorted(hour_counter.items(), key=lambda x: x[1], reverse=True)[:3]
-    # Format hours: e.g., 10 -> "10:00-11:00"
-    active_hour_ranges = [f"{h:02d}:00-{(h+1)%24:02d}:00" for h, _ in active_hours_sorted]
+        total = db.execute(text("SELECT COUNT(*) FROM commands")).scalar() or 0
+        # Active hours (UTC hour bucket), top 3 by frequency.
+        hour_rows = db.execute(text(
+            "SELECT strftime('%H', timestamp) AS h, COUNT(*) AS n "
+            "FROM commands GROUP BY h ORDER BY n DESC LIMIT 3"
+        )).fetchall()
+        # Top tags: GROUP BY over the normalized command_tags table, driven
+        # by the index on `tag`.
+        tag_rows = (
+            db.query(models.CommandTag.tag, func.count())
+            .group_by(models.CommandTag.tag)
+            .order_by(func.count().desc())
+            .limit(5)
+            .all()
+        )
+
+    # Format hours via the precomputed label table.
+    active_hour_ranges = [_HOUR_RANGES[int(h)] for h, _ in hour_rows]
 
     return {
         "total_commands": total,
-        "top_keywords": [k for k, _ in top_keywords],
+        "top_keywords": [tag for tag, _ in tag_rows],
         "active_hours": active_hour_ranges,
     }
 
@@ -78,106 +248,98 @@ def analyze_preferences() -> Dict:
     - common_tasks: tags/keywords like test, refactor, optimize, deploy, debug
     - style: keywords like async, clean, OOP, functional, TDD
     - frameworks/tools (additional, non-breaking fields)
+
+    Cached per data version; recomputed only after a write.
     """
-    # Take a lightweight snapshot of just the fields we need while the session is open
-    with database.session_scope() as db:
-        rows = db.query(models.Command).all()
-        snap = [
-            {
-                "command_text": (r.command_text or ""),
-                "tags": (r.tags.split(",") if r.tags else []),
-            }
-            for r in rows
-        ]
-
-    # Counters
-    tag_counts: Dict[str, int] = {}
-    task_counts: Dict[str, int] = {}
-    style_counts: Dict[str, int] = {}
-    framework_counts: Dict[str, int] = {}
-    tool_counts: Dict[str, int] = {}
-    language_counts: Dict[str, int] = {}
-
-    # Heuristic dictionaries
-    lang_markers = {
-        "python": ["python", ".py", "pip", "pytest", "uv ", "conda", "poetry", "ruff", "mypy"],
-        "typescript": ["typescript", "ts ", ".ts", "tsc", "pnpm", "vite", "nextjs", "next.js"],
-        "javascript": ["javascript", "js ", ".js", "npm", "yarn", "node"],
-        "go": ["golang", " go ", ".go", "go build", "go test"],
-        "java": [" java ", ".java", "maven", "mvn ", "gradle"],
-        "rust": ["rust", ".rs", "cargo"],
-        "bash": ["bash", "zsh", ".sh", "shell"],
-    }
-    task_markers = [
-        "refactor", "test", "optimize", "document", "deploy", "debug",
-        "fix", "lint", "typecheck", "benchmark", "profile", "migrate",
-    ]
-    style_markers = ["async", "clean", "performance", "oop", "functional", "tdd", "cli", "script"]
-    framework_markers = [
-        "fastapi", "flask", "django", "react", "nextjs", "vue", "svelte",
-        "spring", "springboot", "express", "nestjs",
-    ]
-    tool_markers = [
-        "docker", "kubernetes", "k8s", "git", "curl", "jq", "pytest", "pip", "conda", "poetry", "uv ",
-        "alembic", "black", "ruff", "flake8", "mypy", "pre-commit", "eslint", "prettier", "jest", "vitest",
-        "playwright", "cypress",
-    ]
+    return _analyze_preferences_cached(_DATA_VERSION)
 
-    def count_if_present(text: str, markers: List[str], counter: Dict[str, int], key_map: Dict[str, str] | None = None):
-        for m in markers:
-            if m.lower() in text:
-                name = key_map.get(m, m) if key_map else m
-                counter[name] = counter.get(name, 0) + 1
 
-    # Aggregate
-    for item in snap:
-        tags = [t.lower() for t in item["tags"] if t]
-        lower = item["command_text"].lower()
+def _aggregate_signals(rows) -> tuple:
+    """Run the marker aggregation over (lowered_text, lowered_tags) pairs.
+
+    Returns (tag_counts, counters) where counters holds the per-category
+    defaultdicts keyed as languages/tasks/styles/frameworks/tools.
+    """
+    tag_counts: Counter = Counter()
+    counters: Dict[str, Dict[str, int]] = {
+        "languages": defaultdict(int),
+        "tasks": defaultdict(int),
+        "styles": defaultdict(int),
+        "frameworks": defaultdict(int),
+        "tools": defaultdict(int),
+    }
+    language_counts = counters["languages"]
 
-        # Tags as-is
-        for t in tags:
-            tag_counts[t] = tag_counts.get(t, 0) + 1
+    for lower, tags in rows:
+        # Tags as-is (Counter.update is C-implemented)
+        tag_counts.update(tags)
 
         # Language from tags
-        for lang in lang_markers.keys():
+        for lang in LANG_MARKERS.keys():
             if lang in tags:
-                language_counts[lang] = language_counts.get(lang, 0) + 1
-
-        # Language heuristics from text
-        for lang, markers in lang_markers.items():
-            count_before = language_counts.get(lang, 0)
-            count_if_present(lower, markers, language_counts)
-            # reduce accidental double counting if both tag and marker matched strongly
-            if language_counts.get(lang, 0) > count_before:
-                pass
-
-        # Tasks / style / frameworks / tools
-        count_if_present(lower, task_markers, task_counts)
-        count_if_present(lower, style_markers, style_counts)
-        count_if_present(lower, framework_markers, framework_counts)
-        count_if_present(lower, tool_markers, tool_counts)
+                language_counts[lang] += 1
+
+        # One fused-regex pass over the text covers language/task/style/
+        # framework/tool markers. Dedupe by matched word so each marker
+        # still counts at most once per command (presence semantics).
+        seen_words = set()
+        for m in _MARKER_RE.finditer(lower):
+            word = m.group(0)
+            if word in seen_words:
+                continue
+            seen_words.add(word)
+            for counter_name, key in _MARKER_TARGETS[word]:
+                counters[counter_name][key] += 1
+
+    return tag_counts, counters
+
+
+@functools.lru_cache(maxsize=1)
+def _analyze_preferences_cached(version: int) -> Dict:
+    # Stream lightweight (id, command_text) Row tuples in batches with
+    # yield_per and aggregate as they arrive, instead of materializing a
+    # full snapshot list first. Peak memory stays O(batch + counters).
+    with database.session_scope() as db:
+        tags_by_command = _tags_by_command(db)
+        query = db.query(models.Command.id, models.Command.command_text).yield_per(1000)
+        tag_counts, counters = _aggregate_signals(
+            (
+                (command_text or "").lower(),
+                [t.lower() for t in tags_by_command.get(command_id, []) if t],
+            )
+            for command_id, command_text in query
+        )
+
+    language_counts = counters["languages"]
+    task_counts = counters["tasks"]
+    style_counts = counters["styles"]
+    framework_counts = counters["frameworks"]
+    tool_counts = counters["tools"]
 
     # Preferred language selection
     preferred_language = None
     preferred_language_confidence = None
     if language_counts:
-        lang_sorted = sorted(language_counts.items(), key=lambda x: x[1], reverse=True)
-        top_lang, top_count = lang_sorted[0]
+        top_lang, top_count = max(language_counts.items(), key=itemgetter(1))
         total = sum(language_counts.values())
         confidence = (top_count / total) if total else 1.0
         preferred_language = top_lang.capitalize() if top_lang == "python" else top_lang
         preferred_language_confidence = round(confidence, 3)
 
-    # Top tasks and style summary
+    # Top tasks and style summary. nlargest is O(N log K) with a C-level
+    # key, versus sorting the whole counter per field.
     common_tasks = [
         k.replace("document", "documentation")
-        for k, _ in sorted(task_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+        for k, _ in nlargest(5, task_counts.items(), key=itemgetter(1))
     ]
-    style_summary = ", ".join([k.upper() if k in ("oop", "tdd") else k for k, _ in sorted(style_counts.items(), key=lambda x: x[1], reverse=True)[:5]]) or None
+    style_summary = ", ".join([
+        k.upper() if k in ("oop", "tdd") else k
+        for k, _ in nlargest(5, style_counts.items(), key=itemgetter(1))
+    ]) or None
 
     # Additional informative fields (non-breaking): frameworks and tools
-    frameworks = [k for k, _ in sorted(framework_counts.items(), key=lambda x: x[1], reverse=True)[:5]]
-    tools = [k for k, _ in sorted(tool_counts.items(), key=lambda x: x[1], reverse=True)[:8]]
+    frameworks = [k for k, _ in nlargest(5, framework_counts.items(), key=itemgetter(1))]
+    tools = [k for k, _ in nlargest(8, tool_counts.items(), key=itemgetter(1))]
 
     return {
         "preferred_language": preferred_language,
@@ -222,28 +384,55 @@ def analyze_preferences_contextual(context: str, limit: int = 50) -> Dict:
 
     matched_groups = [g for g, kws in context_groups.items() if any(k in lowered for k in kws)]
 
-    # Filter tasks/styles/tools/frameworks based on matched groups heuristics
-    def filter_list(values: List[str], relevance_words: List[str]) -> List[str]:
-        if not relevance_words:
-            return []
-        lv = lowered
-        return [v for v in values if any(w in lv or w in v for w in relevance_words)]
-
     relevance_words = []
     for g in matched_groups:
         relevance_words.extend(context_groups[g])
 
+    # Filter tasks/styles/tools/frameworks based on matched groups heuristics.
+    # One compiled alternation replaces the per-candidate any(w in v ...)
+    # substring loop over the relevance words.
+    rw_re = re.compile("|".join(map(re.escape, relevance_words))) if relevance_words else None
+
+    def filter_list(values: List[str]) -> List[str]:
+        if rw_re is None:
+            return []
+        return [v for v in values if rw_re.search(v)]
+
+    # Push the context filter down to the database: only commands matching a
+    # relevance word (FTS5 prefix match, newest first, capped at limit) are
+    # re-aggregated for the overlap signals, instead of scanning every row.
+    overlap_counters: Dict[str, Dict[str, int]] = {"tasks": {}, "styles": {}, "tools": {}}
+    if relevance_words:
+        fts_query = " OR ".join(f"{w}*" for w in relevance_words)
+        with database.session_scope() as db:
+            rows = db.execute(text(
+                "SELECT c.id, c.command_text "
+                "FROM command_fts f JOIN commands c ON c.id = f.rowid "
+                "WHERE command_fts MATCH :q "
+                "ORDER BY c.timestamp DESC, c.id DESC LIMIT :limit"
+            ), {"q": fts_query, "limit": limit}).fetchall()
+            ids = [r[0] for r in rows]
+            tags_by_command = _tags_by_command(db, ids) if ids else {}
+        _, overlap_counters = _aggregate_signals(
+            (
+                (command_text or "").lower(),
+                [t.lower() for t in tags_by_command.get(command_id, []) if t],
+            )
+            for command_id, command_text in rows
+        )
+
+    relevance_set = set(relevance_words)
     contextual = {
         "matched_groups": matched_groups,
         "preferred_language": base.get("preferred_language"),
-        "style_subset": filter_list(base.get("style", "").split(", "), relevance_words),
-        "tasks_subset": filter_list(base.get("common_tasks", []), relevance_words),
-        "frameworks_subset": filter_list(base.get("frameworks", []), relevance_words),
-        "tools_subset": filter_list(base.get("tools", []), relevance_words),
+        "style_subset": filter_list((base.get("style") or "").split(", ")),
+        "tasks_subset": filter_list(base.get("common_tasks", [])),
+        "frameworks_subset": filter_list(base.get("frameworks", [])),
+        "tools_subset": filter_list(base.get("tools", [])),
         "signals_overlap": {
-            "tasks": {k: v for k, v in base.get("signals", {}).get("tasks", {}).items() if k in relevance_words},
-            "styles": {k: v for k, v in base.get("signals", {}).get("styles", {}).items() if k in relevance_words},
-            "tools": {k: v for k, v in base.get("signals", {}).get("tools", {}).items() if k in relevance_words},
+            "tasks": {k: v for k, v in overlap_counters["tasks"].items() if k in relevance_set},
+            "styles": {k: v for k, v in overlap_counters["styles"].items() if k in relevance_set},
+            "tools": {k: v for k, v in overlap_counters["tools"].items() if k in relevance_set},
         },
         "context": context,
     }
@@ -262,24 +451,26 @@ def get_recent_context(limit: int = 5):
     """Return the most recent user commands up to the given limit.
 
     Provides a simplified context of recent raw instructions (command_text)
-    and associated tags. We serialize while the session is active.
+    and associated tags.
     """
     with database.session_scope() as db:
         recents = (
-            db.query(models.Command)
-            .order_by(models.Command.timestamp.desc())
+            db.query(models.Command.id, models.Command.command_text, _TS_ISO)
+            .order_by(models.Command.timestamp.desc(), models.Command.id.desc())
             .limit(limit)
             .all()
         )
-        items = [
-            {
-                "command_text": r.command_text,
-                "tags": r.tags.split(",") if r.tags else [],
-                "timestamp": r.timestamp.isoformat() + "Z",
-            }
-            for r in recents
-        ]
-        return {
-            "recent_commands": [i["command_text"] for i in items],
-            "items": items,
+        ids = [r[0] for r in recents]
+        tags_by_command = _tags_by_command(db, ids) if ids else {}
+    items = [
+        {
+            "command_text": command_text,
+            "tags": tags_by_command.get(command_id, []),
+            "timestamp": ts,
         }
+        for command_id, command_text, ts in recents
+    ]
+    return {
+        "recent_commands": [i["command_text"] for i in items],
+        "items": items,
+    }
@@ -1,11 +1,38 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
 from contextlib import contextmanager
 
 # SQLite database stored in /app/data/memory.db (mapped to host)
 SQLALCHEMY_DATABASE_URL = "sqlite:///./data/memory.db"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# Per-connection SQLite tuning:
+# - WAL lets readers proceed while a write is in progress (default journal
+#   mode serializes readers behind writers)
+# - synchronous=NORMAL skips the per-commit fsync that FULL does; still
+#   durable enough for WAL
+# - temp_store/mmap/cache reduce syscall and I/O traffic on scans
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+)
+
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=10,
+    max_overflow=20,
+)
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _connection_record):
+    cursor = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
 # Important: prevent attribute expiration on commit so ORM instances remain usable
 # after the session is closed (we serialize them outside the session context).
 # Without this, accessing attributes may trigger a refresh on a closed session,
@@ -18,10 +45,95 @@ SessionLocal = sessionmaker(
 )
 Base = declarative_base()
 
+# FTS5 inverted index over command text, kept in sync by triggers so search
+# is an index lookup instead of a LIKE '%q%' scan of every row.
+_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS command_fts USING fts5("
+    "command_text, content='commands', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS commands_fts_ai AFTER INSERT ON commands BEGIN "
+    "INSERT INTO command_fts(rowid, command_text) VALUES (new.id, new.command_text); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS commands_fts_ad AFTER DELETE ON commands BEGIN "
+    "INSERT INTO command_fts(command_fts, rowid, command_text) "
+    "VALUES ('delete', old.id, old.command_text); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS commands_fts_au AFTER UPDATE ON commands BEGIN "
+    "INSERT INTO command_fts(command_fts, rowid, command_text) "
+    "VALUES ('delete', old.id, old.command_text); "
+    "INSERT INTO command_fts(rowid, command_text) VALUES (new.id, new.command_text); "
+    "END",
+    # Re-sync the index with the content table (covers rows written before
+    # the FTS table existed); cheap at this database's scale.
+    "INSERT INTO command_fts(command_fts) VALUES ('rebuild')",
+    # create_all only checks table existence, so make sure databases created
+    # before the descending timestamp index pick it up too.
+    "CREATE INDEX IF NOT EXISTS ix_commands_ts ON commands(timestamp DESC)",
+)
+
+
+def _migrate_legacy_schema(conn):
+    """One-time upgrades for databases created before the current schema.
+
+    create_all only creates missing tables, so pre-existing files (the data
+    directory is persisted on the host) need explicit DDL to catch up, the
+    same way _FTS_DDL backfills the FTS index for older rows.
+    """
+    # Tags used to live on commands as a comma-separated string. Move them
+    # into command_tags rows, then drop the old column so this runs once.
+    has_legacy_tags = conn.exec_driver_sql(
+        "SELECT 1 FROM pragma_table_info('commands') WHERE name = 'tags'"
+    ).fetchone() is not None
+    if has_legacy_tags:
+        rows = conn.exec_driver_sql(
+            "SELECT id, tags FROM commands WHERE tags IS NOT NULL AND tags != ''"
+        ).fetchall()
+        params = [
+            (command_id, tag)
+            for command_id, csv in rows
+            for tag in (part.strip() for part in csv.split(","))
+            if tag
+        ]
+        if params:
+            conn.exec_driver_sql(
+                "INSERT INTO command_tags (command_id, tag) VALUES (?, ?)", params
+            )
+        conn.exec_driver_sql("ALTER TABLE commands DROP COLUMN tags")
+
+    # Pre-server-default tables declare timestamp NOT NULL with no DDL
+    # default (the default used to be Python-side), so inserts that omit
+    # the column fail. SQLite cannot add a default in place, so rebuild
+    # the table once with the current DDL and copy the rows across.
+    needs_default = conn.exec_driver_sql(
+        "SELECT 1 FROM pragma_table_info('commands') "
+        "WHERE name = 'timestamp' AND dflt_value IS NULL"
+    ).fetchone() is not None
+    if needs_default:
+        conn.exec_driver_sql(
+            "CREATE TABLE commands_new ("
+            "id INTEGER NOT NULL, "
+            "command_text TEXT NOT NULL, "
+            "timestamp DATETIME DEFAULT (CURRENT_TIMESTAMP) NOT NULL, "
+            "PRIMARY KEY (id))"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO commands_new (id, command_text, timestamp) "
+            "SELECT id, command_text, timestamp FROM commands"
+        )
+        # Dropping commands also drops its triggers and indexes; _FTS_DDL
+        # recreates the triggers and ix_commands_ts right afterwards.
+        conn.exec_driver_sql("DROP TABLE commands")
+        conn.exec_driver_sql("ALTER TABLE commands_new RENAME TO commands")
+        conn.exec_driver_sql("CREATE INDEX ix_commands_id ON commands (id)")
+
+
 def init_db():
-    """Initialize database tables."""
+    """Initialize database tables and the FTS index."""
     import models  # local module
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        _migrate_legacy_schema(conn)
+        for ddl in _FTS_DDL:
+            conn.exec_driver_sql(ddl)
 
 
 @contextmanager
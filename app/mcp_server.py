@@ -1,16 +1,29 @@
 from __future__ import annotations
 
-import json
-from typing import Any, Dict, List, Optional
-
+import asyncio
+import functools
+import logging
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+import orjson
 from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp.utilities.func_metadata import FuncMetadata
+from pydantic import Field
 
 import crud
 import database
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
+
+logger = logging.getLogger(__name__)
+
 
-# Initialize DB tables
-database.init_db()
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (Rust) instead of stdlib json."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
 
 # Create FastMCP server for MCP traffic
 # Provide concise server instructions to guide LLMs on when to use memory tools.
@@ -19,7 +32,7 @@ mcp = FastMCP(
     instructions=(
         "Command Memory Layer:"
         " Use 'record_command(command_text, tags?)' (MCP Tool) to persist raw user instructions."
-        " Use 'memory_context(token, limit?)' (MCP Tool) to retrieve recent user commands for grounding."
+        " Use 'memory_context(limit?)' (MCP Tool) to retrieve recent user commands for grounding."
         " Use 'commands()' (MCP Tool) to list all stored commands."
         " Use 'stats()' (MCP Tool) to get simple usage statistics."
         " Use 'preferences()' (MCP Tool) to get heuristic preference analysis."
@@ -39,7 +52,52 @@ mcp.settings.streamable_http_path = "/mcp"
 def user_recent_resource(token: str) -> str:
     """Return recent command context as JSON string (token ignored in single-user mode)."""
     data = crud.get_recent_context(limit=10)
-    return json.dumps(data)
+    return orjson.dumps(data).decode()
+
+
+# Process-local result caches keyed on crud's data version, which bumps on
+# every write: a stale generation simply misses the cache, so invalidation
+# is automatic. compute_stats/analyze_preferences are already cached the
+# same way inside crud.
+@functools.lru_cache(maxsize=1)
+def _cached_list_commands(version: int) -> list[dict]:
+    return crud.list_commands()
+
+
+_WS_RE = re.compile(r"\s+")
+
+
+def _normalize_context(context: str) -> str:
+    """Lowercase, collapse whitespace and bound the context string.
+
+    LLM clients frequently resubmit near-identical prompts across a session;
+    normalizing before the cache key lets those share one entry, and the
+    length bound keeps cache keys small. The analysis itself lowercases
+    anyway, so the result is unchanged.
+    """
+    return _WS_RE.sub(" ", context).strip().lower()[:512]
+
+
+@functools.lru_cache(maxsize=64)
+def _cached_contextual_preferences(version: int, context: str, limit: int) -> dict:
+    return crud.analyze_preferences_contextual(context=context, limit=limit)
+
+
+# Serialized-bytes caches for the read-only REST routes: on a hit the
+# response is a memcpy of the cached body, skipping the render step too.
+@functools.lru_cache(maxsize=1)
+def _commands_body(version: int) -> bytes:
+    return orjson.dumps(_cached_list_commands(version), option=orjson.OPT_NON_STR_KEYS)
+
+
+@functools.lru_cache(maxsize=1)
+def _stats_body(version: int) -> bytes:
+    return orjson.dumps(crud.compute_stats(), option=orjson.OPT_NON_STR_KEYS)
+
+
+@functools.lru_cache(maxsize=1)
+def _preferences_body(version: int) -> bytes:
+    return orjson.dumps(crud.analyze_preferences(), option=orjson.OPT_NON_STR_KEYS)
 
 
 # Tools
@@ -47,8 +105,8 @@ def user_recent_resource(token: str) -> str:
 
 
 @mcp.tool(name="memory_context")
-def tool_context(token: str, limit: int = 10) -> dict:
-    """Return recent command context (single-user; token is ignored). Limit is advisory."""
+def tool_context(limit: int = 10) -> dict:
+    """Return recent command context (single-user). Limit is advisory."""
     context = crud.get_recent_context(limit=limit)
     return context
 
@@ -71,8 +129,13 @@ def tool_record_command(command_text: str, tags: Optional[List[str]] = None) ->
         tags = []
     if not isinstance(tags, list):
         return {"error": "tags_must_be_list"}
-    # Coerce non-string items to strings defensively
-    safe_tags = [str(t) for t in tags if t is not None]
+    # Fast path: callers are almost always programs sending a clean
+    # list[str], so skip the rebuild (type(t) is str avoids the MRO walk);
+    # otherwise coerce non-string items to strings defensively.
+    if all(type(t) is str for t in tags):
+        safe_tags = tags
+    else:
+        safe_tags = [str(t) for t in tags if t is not None]
     crud.create_command(command_text=command_text, tags=safe_tags)
     return {"status": "ok"}
 
@@ -80,7 +143,7 @@ def tool_record_command(command_text: str, tags: Optional[List[str]] = None) ->
 @mcp.tool(name="commands")
 def tool_list_commands() -> list[dict]:
     """Return all historical commands for the authenticated user (newest first)."""
-    return crud.list_commands()
+    return _cached_list_commands(crud._DATA_VERSION)
 
 
 @mcp.tool(name="stats")
@@ -101,107 +164,254 @@ def tool_contextual_preferences(context: str, limit: int = 50) -> dict:
 
         Inputs:
             - context: free-form task or instruction text
-            - limit: advisory cap (currently unused but reserved for future recency filtering)
+            - limit: cap on the context-matched recent commands re-aggregated for overlap signals
         """
-        return crud.analyze_preferences_contextual(context=context, limit=limit)
+        return _cached_contextual_preferences(crud._DATA_VERSION, _normalize_context(context), limit)
+
+
+# Static descriptor to avoid relying on private internals of FastMCP; built
+# once at import so help calls do not re-allocate the nested structure.
+_HELP_PAYLOAD = {
+    "tools": [
+        {
+            "name": "memory_context",
+            "args": {"limit": "int=10"},
+            "description": "Return recent command context (single-user).",
+        },
+        {
+            "name": "record_command",
+            "args": {"command_text": "string", "tags": "list[string]=[]"},
+            "description": "Persist a raw user instruction with optional tags.",
+        },
+        {"name": "commands", "args": {}, "description": "List all stored commands (newest first)."},
+        {"name": "stats", "args": {}, "description": "Basic usage statistics across commands."},
+        {"name": "preferences", "args": {}, "description": "Heuristic preference analysis."},
+        {
+            "name": "contextual_preferences",
+            "args": {"context": "string", "limit": "int=50"},
+            "description": "Task-focused preference subset based on provided context string.",
+        },
+    ]
+}
 
 
 @mcp.tool(name="help")
 def tool_help() -> dict:
     """List available tools and their usage signatures for this server."""
-    # Static descriptor to avoid relying on private internals of FastMCP
-    return {
-        "tools": [
-            {
-                "name": "memory_context",
-                "args": {"token": "string (ignored)", "limit": "int=10"},
-                "description": "Return recent command context (single-user).",
-            },
-            {
-                "name": "record_command",
-                "args": {"command_text": "string", "tags": "list[string]=[]"},
-                "description": "Persist a raw user instruction with optional tags.",
-            },
-            {"name": "commands", "args": {}, "description": "List all stored commands (newest first)."},
-            {"name": "stats", "args": {}, "description": "Basic usage statistics across commands."},
-            {"name": "preferences", "args": {}, "description": "Heuristic preference analysis."},
-            {
-                "name": "contextual_preferences",
-                "args": {"context": "string", "limit": "int=50"},
-                "description": "Task-focused preference subset based on provided context string.",
-            },
-        ]
+    return _HELP_PAYLOAD
+
+
+# Opt-in tool dispatch fast path (FAST_TOOLS=1): the hottest tools take a
+# tiny fixed argument shape, yet every call still walks pydantic's generic
+# validator before reaching the function. Swapping in a hand-written
+# straight-line validator skips that walk; bad arguments raise and surface
+# as a ToolError exactly like a pydantic failure would. The advertised JSON
+# schema (tool.parameters) is untouched. Off by default because the generic
+# path also JSON-decodes string-encoded arguments from sloppy clients.
+
+class _StraightLineMetadata(FuncMetadata):
+    """FuncMetadata whose validation step is a hand-written callable."""
+
+    validator: Callable[[dict], dict] = Field(exclude=True)
+
+    async def call_fn_with_arg_validation(self, fn, fn_is_async, arguments_to_validate, arguments_to_pass_directly):
+        kwargs = self.validator(arguments_to_validate)
+        kwargs |= arguments_to_pass_directly or {}
+        if fn_is_async:
+            return await fn(**kwargs)
+        return fn(**kwargs)
+
+
+def _install_fast_validators() -> None:
+    fast = {
+        "record_command": lambda kw: {
+            "command_text": kw["command_text"],
+            "tags": kw.get("tags") or [],
+        },
+        "memory_context": lambda kw: {"limit": int(kw.get("limit", 10))},
     }
+    for name, validator in fast.items():
+        tool = mcp._tool_manager.get_tool(name)
+        meta = tool.fn_metadata
+        tool.fn_metadata = _StraightLineMetadata(
+            arg_model=meta.arg_model,
+            output_schema=meta.output_schema,
+            output_model=meta.output_model,
+            wrap_output=meta.wrap_output,
+            validator=validator,
+        )
+
+
+if os.environ.get("FAST_TOOLS") == "1":
+    _install_fast_validators()
 
 
 # Optional: Prompts to guide clients/LLMs
 ## Removed legacy prompts related to record storage and search.
 
 
-# Lightweight health endpoint for quick readiness checks
+# Lightweight health endpoint for quick readiness checks. The payload never
+# changes at runtime, so it is encoded once at import and the same immutable
+# Response is reused for every probe.
+_HEALTH_RESPONSE = Response(
+    orjson.dumps({
+        "status": "ok",
+        "transport": "streamable-http",
+        "path": mcp.settings.streamable_http_path,
+    }),
+    media_type="application/json",
+)
+
+
 @mcp.custom_route("/healthz", methods=["GET"])
 async def health_check(request):
-    return JSONResponse({"status": "ok", "transport": "streamable-http", "path": mcp.settings.streamable_http_path})
+    return _HEALTH_RESPONSE
 
 
 # ------------------------------
 # REST API: Command Memory Layer
 # ------------------------------
 
+# Write-behind queue for /record_command: each POST used to pay a full
+# transaction (and fsync) of its own. Writes are enqueued and a background
+# task coalesces up to _WRITE_BATCH_MAX rows or _WRITE_FLUSH_SECONDS into
+# one batched create_commands call, which also bumps the data version so
+# the read caches invalidate after each flush.
+_WRITE_BATCH_MAX = 64
+_WRITE_FLUSH_SECONDS = 0.02
+# A flush failure must not lose writes the client was already told were
+# queued: retry with backoff (covers transient SQLITE_BUSY), and only give
+# up on a batch after logging exactly what was dropped.
+_WRITE_RETRY_MAX = 3
+_WRITE_RETRY_SECONDS = 0.05
+
+_write_queue: asyncio.Queue = asyncio.Queue()
+_write_flusher: asyncio.Task | None = None
+
+
+async def _flush_batch(batch: list[dict]) -> None:
+    for attempt in range(1, _WRITE_RETRY_MAX + 1):
+        try:
+            await asyncio.to_thread(crud.create_commands, batch)
+            return
+        except Exception:
+            if attempt == _WRITE_RETRY_MAX:
+                logger.exception(
+                    "dropping %d queued command(s) after %d failed flushes",
+                    len(batch),
+                    _WRITE_RETRY_MAX,
+                )
+            else:
+                logger.warning(
+                    "flush of %d queued command(s) failed (attempt %d/%d), retrying",
+                    len(batch),
+                    attempt,
+                    _WRITE_RETRY_MAX,
+                    exc_info=True,
+                )
+                await asyncio.sleep(_WRITE_RETRY_SECONDS * attempt)
+
+
+async def _drain_writes():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _write_queue.get()]
+        deadline = loop.time() + _WRITE_FLUSH_SECONDS
+        while len(batch) < _WRITE_BATCH_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_write_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        await _flush_batch(batch)
+
+
+def _ensure_write_flusher():
+    """Start the flush task on first use (needs a running event loop)."""
+    global _write_flusher
+    if _write_flusher is None or _write_flusher.done():
+        _write_flusher = asyncio.get_running_loop().create_task(_drain_writes())
+
+
 @mcp.custom_route("/record_command", methods=["POST"])
 async def record_command(request):
-    """Save a raw user command.
+    """Save a raw user command (queued; persisted within ~20 ms).
 
     Body: { "command_text": str, "tags": [str, ...] }
     """
     try:
-        data = await request.json()
-    except Exception:
-        return JSONResponse({"error": "invalid_json"}, status_code=400)
+        data = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        return ORJSONResponse({"error": "invalid_json"}, status_code=400)
 
     command_text = (data or {}).get("command_text")
     tags = (data or {}).get("tags", []) or []
     if not command_text or not isinstance(command_text, str):
-        return JSONResponse({"error": "command_text_required"}, status_code=400)
+        return ORJSONResponse({"error": "command_text_required"}, status_code=400)
     if not isinstance(tags, list):
-        return JSONResponse({"error": "tags_must_be_list"}, status_code=400)
+        return ORJSONResponse({"error": "tags_must_be_list"}, status_code=400)
 
-    crud.create_command(command_text=command_text, tags=tags)
-    return JSONResponse({"status": "ok"})
+    _ensure_write_flusher()
+    await _write_queue.put({"command_text": command_text, "tags": tags})
+    return ORJSONResponse({"status": "queued"})
 
 
 @mcp.custom_route("/commands", methods=["GET"])
 async def list_commands(request):
     """Return all historical commands for the authenticated user."""
-    items = crud.list_commands()
-    return JSONResponse(items)
+    body = await asyncio.to_thread(_commands_body, crud._DATA_VERSION)
+    return Response(body, media_type="application/json")
 
 
 @mcp.custom_route("/stats", methods=["GET"])
 async def stats(request):
-    data = crud.compute_stats()
-    return JSONResponse(data)
+    body = await asyncio.to_thread(_stats_body, crud._DATA_VERSION)
+    return Response(body, media_type="application/json")
 
 
 @mcp.custom_route("/preferences", methods=["GET"])
 async def preferences(request):
-    data = crud.analyze_preferences()
-    return JSONResponse(data)
+    body = await asyncio.to_thread(_preferences_body, crud._DATA_VERSION)
+    return Response(body, media_type="application/json")
 
 
 @mcp.custom_route("/preferences/contextual", methods=["POST"])
 async def preferences_contextual(request):
     try:
-        body = await request.json()
-    except Exception:
-        return JSONResponse({"error": "invalid_json"}, status_code=400)
+        body = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        return ORJSONResponse({"error": "invalid_json"}, status_code=400)
     context = (body or {}).get("context", "")
     limit = (body or {}).get("limit", 50)
-    data = crud.analyze_preferences_contextual(context=context, limit=limit)
-    return JSONResponse(data)
+    if not isinstance(context, str):
+        return ORJSONResponse({"error": "context_must_be_string"}, status_code=400)
+    # Also keeps "50" vs 50 from creating duplicate cache entries.
+    if not isinstance(limit, int):
+        return ORJSONResponse({"error": "limit_must_be_int"}, status_code=400)
+    data = await asyncio.to_thread(
+        _cached_contextual_preferences, crud._DATA_VERSION, _normalize_context(context), limit
+    )
+    return ORJSONResponse(data)
+
+
+@functools.cache
+def create_app() -> FastMCP:
+    """Return the process-wide FastMCP app, initializing the DB exactly once.
+
+    functools.cache makes repeat calls (extra imports, workers, tests)
+    no-ops after the first, so DB init cannot run twice per process.
+    """
+    database.init_db()
+    return mcp
+
+
+# Initialize eagerly so plain `import mcp_server` consumers get a ready DB.
+create_app()
 
 
 if __name__ == "__main__":
     # Run as a standalone Streamable HTTP MCP server on 0.0.0.0:8000
     # Note: Run AFTER registering prompts and custom routes so they are available.
-    mcp.run(transport="streamable-http")
+    create_app().run(transport="streamable-http")
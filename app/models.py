@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import func
 from database import Base
-import datetime
 
 class Command(Base):
     """Single-user command memory entries captured via REST API.
@@ -11,5 +12,33 @@ class Command(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     command_text = Column(Text, nullable=False)
-    tags = Column(String)  # comma-separated list
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True, nullable=False)
+    # Server-side default: SQLite stamps the row itself, so inserts allocate
+    # no Python datetime (and utcnow is deprecated since 3.12 anyway).
+    timestamp = Column(DateTime, server_default=func.now(), nullable=False)
+
+    # Descending index matches the ORDER BY timestamp DESC LIMIT N shape of
+    # every listing query, so recent-N reads are a bounded index range scan
+    # instead of a full sort.
+    __table_args__ = (Index("ix_commands_ts", timestamp.desc()),)
+
+    # One row per tag (see CommandTag); replaces the old comma-separated string.
+    tags = relationship(
+        "CommandTag",
+        back_populates="command",
+        cascade="all, delete-orphan",
+    )
+
+
+class CommandTag(Base):
+    """Normalized tag rows, one per (command, tag) pair.
+
+    Storing tags as child rows instead of a CSV blob means reads never parse
+    strings and tag aggregation can be driven by the index on `tag`.
+    """
+    __tablename__ = "command_tags"
+
+    id = Column(Integer, primary_key=True)
+    command_id = Column(Integer, ForeignKey("commands.id"), nullable=False, index=True)
+    tag = Column(String, nullable=False, index=True)
+
+    command = relationship("Command", back_populates="tags")